@@ -1,18 +1,85 @@
 import sys
 import math
-import threading
-from PIL import ImageGrab
-from PyQt6.QtWidgets import QApplication, QWidget, QPushButton, QInputDialog, QVBoxLayout, QHBoxLayout, QTextBrowser, QLineEdit
-from PyQt6.QtGui import QPainter, QPixmap, QPen, QColor, QMouseEvent, QImage, QFont, QLinearGradient, QPainterPath, QTextCursor
-from PyQt6.QtCore import Qt, QPoint, QRect, QTimer, QSize, QBuffer, QIODevice, QPointF, QRectF, pyqtSignal
+import asyncio
+import html
+try:
+    import mss
+except ImportError:
+    mss = None  # fall back to Qt's native grab
+try:
+    import numba
+except ImportError:
+    numba = None  # rdp_np falls back to the interpreted loop
+import numpy as np
+from PyQt6.QtWidgets import QApplication, QPushButton, QInputDialog, QVBoxLayout, QHBoxLayout, QTextBrowser, QLineEdit
+from PyQt6.QtOpenGLWidgets import QOpenGLWidget
+from PyQt6.QtGui import QPainter, QPixmap, QPen, QBrush, QRegion, QColor, QMouseEvent, QImage, QFont, QLinearGradient, QPainterPath, QPixmapCache, QPolygon, QStaticText, QTextCursor, QTransform
+from PyQt6.QtCore import Qt, QObject, QPoint, QRect, QTimer, QSize, QBuffer, QIODevice, QRectF, QRunnable, QThreadPool, pyqtSignal
 from PIL import Image, ImageFilter
 import litellm # Import litellm
 import markdown # Import markdown library
+import qasync # Bridges the Qt and asyncio event loops
 import base64 # For base64 encoding images
 import io # For in-memory image handling (still useful for general byte operations, but QBuffer for QImage.save)
 
 MODES = ['freestyle', 'rect', 'arrow', 'text', 'blur', 'highlight', 'erase']
 
+# Arrowhead geometry: the barbs sit at a fixed +/- 30 degrees off the shaft,
+# so precompute the rotation terms instead of calling atan2/cos/sin per draw
+_ARROW_CA = math.cos(math.pi / 6)
+_ARROW_SA = math.sin(math.pi / 6)
+_ARROW_LEN = 10
+
+def rdp_np(pts, eps):
+    """
+    Ramer-Douglas-Peucker over an (N, 2) point array; returns the boolean
+    keep-mask. Iterative stack form so Numba compiles a tight loop.
+    """
+    n = pts.shape[0]
+    keep = np.zeros(n, dtype=np.bool_)
+    keep[0] = True
+    keep[n - 1] = True
+    stack = np.empty((n, 2), dtype=np.int64)
+    top = 0
+    stack[top, 0] = 0
+    stack[top, 1] = n - 1
+    top += 1
+    while top > 0:
+        top -= 1
+        s = stack[top, 0]
+        e = stack[top, 1]
+        ax = float(pts[s, 0])
+        ay = float(pts[s, 1])
+        dx = float(pts[e, 0]) - ax
+        dy = float(pts[e, 1]) - ay
+        norm = math.sqrt(dx * dx + dy * dy)
+        dmax = -1.0
+        imax = -1
+        for i in range(s + 1, e):
+            px = float(pts[i, 0]) - ax
+            py = float(pts[i, 1]) - ay
+            if norm == 0.0:
+                d = math.sqrt(px * px + py * py)
+            else:
+                d = abs(dy * px - dx * py) / norm
+            if d > dmax:
+                dmax = d
+                imax = i
+        if dmax > eps:
+            keep[imax] = True
+            stack[top, 0] = s
+            stack[top, 1] = imax
+            top += 1
+            stack[top, 0] = imax
+            stack[top, 1] = e
+            top += 1
+    return keep
+
+
+if numba is not None:
+    rdp_np = numba.njit(cache=True, fastmath=True)(rdp_np)
+
+
 # unicode icons for modes
 MODE_ICONS = {
     'freestyle': '✏️',
@@ -24,12 +91,58 @@ MODE_ICONS = {
     'erase': '🧽',
 }
 
-class ScreenshotAnnotator(QWidget):
+class _CaptureSignals(QObject):
+    captured = pyqtSignal(QImage)
+
+
+class _CaptureTask(QRunnable):
+    """
+    Grabs the screen on the global thread pool so the window can show
+    before the capture finishes. mss handles are thread-bound, so the
+    worker owns its own instance.
+    """
+    def __init__(self):
+        super().__init__()
+        self.signals = _CaptureSignals()
+
+    def run(self):
+        # mss hands back the BGRA buffer the OS capture produced, which is
+        # Qt's native 32-bit little-endian layout - no channel conversion.
+        # monitors[1] is the primary display; monitors[0] would span the
+        # whole virtual desktop and mismatch the full-screen widget.
+        with mss.mss() as sct:
+            shot = sct.grab(sct.monitors[1])
+        img = QImage(shot.raw, shot.width, shot.height, shot.width * 4, QImage.Format.Format_RGB32)
+        self.signals.captured.emit(img.copy())  # detach from the worker's buffer
+
+
+class _ImageSaveTask(QRunnable):
+    """
+    Writes an image to disk on the global thread pool so the PNG deflate
+    of a multi-megapixel selection doesn't block the GUI thread.
+    """
+    def __init__(self, image, path):
+        super().__init__()
+        self._image = image
+        self._path = path
+
+    def run(self):
+        self._image.save(self._path)
+
+
+# QOpenGLWidget moves the compositing to the GPU: the full-screen blit and
+# the semi-transparent annotation layers become texture draws instead of
+# CPU raster fills, and the paintEvent code is unchanged.
+class ScreenshotAnnotator(QOpenGLWidget):
     llm_chunk_received = pyqtSignal(str)
     llm_stream_finished = pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
+        # Dirty-rect repaints rely on pixels outside the damaged region
+        # surviving from the previous frame; the GL default discards the
+        # framebuffer between paints, so ask for partial updates
+        self.setUpdateBehavior(QOpenGLWidget.UpdateBehavior.PartialUpdate)
         self.setWindowFlags(
             Qt.WindowType.FramelessWindowHint |
             Qt.WindowType.WindowStaysOnTopHint
@@ -37,14 +150,29 @@ class ScreenshotAnnotator(QWidget):
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
         self.setCursor(Qt.CursorShape.CrossCursor)
 
-        # Capture screen
-        img = ImageGrab.grab().convert("RGBA")
-        data = img.tobytes("raw", "RGBA")
-        qimg = QImage(data, img.width, img.height, QImage.Format.Format_RGBA8888)
-        self.bg_pixmap = QPixmap.fromImage(qimg)
-
-        self.resize(self.bg_pixmap.size())
-        self.strokes = []
+        QPixmapCache.setCacheLimit(64 * 1024)  # room for full-screen crops (KB)
+        # Kick the capture off on the thread pool; the window shows
+        # immediately and _on_screen_captured swaps the real pixels in
+        self.bg_pixmap = QPixmap()
+        self._dim_bg = QPixmap()
+        if mss is not None:
+            self._capture_task = _CaptureTask()
+            self._capture_task.signals.captured.connect(self._on_screen_captured)
+            QThreadPool.globalInstance().start(self._capture_task)
+        else:
+            # grabWindow must run on the GUI thread, so this path is
+            # synchronous; it still stays in QPixmap with no Python-side copy
+            self._on_screen_captured(
+                QApplication.primaryScreen().grabWindow(0).toImage())
+
+        self.resize(QApplication.primaryScreen().size())
+        # Selection stroke points as a preallocated (N, 2) int32 array;
+        # appending writes into the buffer and doubles it on overflow
+        self._stroke_buf = np.empty((1024, 2), dtype=np.int32)
+        self._n_strokes = 0
+        # Paint-side mirror of the stroke: grown point-by-point so paintEvent
+        # never rebuilds a polygon from the array
+        self._stroke_poly = QPolygon()
         self.last_point = QPoint()
         self.drawing = False
         self.selection_rect = QRect()
@@ -52,14 +180,22 @@ class ScreenshotAnnotator(QWidget):
         self.selection_confirmed = False
 
         # --- Initial Full-Screen Animation State (now continuous wave) ---
-        self.gradient_phase = 0.0 # Phase for the wave animation
         self.initial_animation_timer = QTimer(self) # Timer for the initial animation
         self.initial_animation_timer.timeout.connect(self.update_initial_animation)
-        self.initial_animation_timer.setInterval(30) # Update every 30ms
+        self.initial_animation_timer.setInterval(60) # ~16 FPS is plenty for the border sweep
         self.initial_animation_timer.start() # Animation now starts immediately on launch
 
         self.border_angle = 0.0 # New variable for border gradient rotation
 
+        # Coalesce mouse-move repaints to ~60 Hz; a high-sample-rate mouse
+        # would otherwise schedule a near-identical paint per sample
+        self._paint_pending = False
+        self._pending_rect = QRect()
+        self._paint_timer = QTimer(self)
+        self._paint_timer.setSingleShot(True)
+        self._paint_timer.setInterval(16)
+        self._paint_timer.timeout.connect(self._flush_paint)
+
         # Annotation state
         self.annotation_canvas = None
         self.annotation_base = None
@@ -68,72 +204,121 @@ class ScreenshotAnnotator(QWidget):
         self.mode = MODES[self.mode_index]
         self.pen = QPen(QColor(102, 204, 255), 4)
         self.border_color = QColor(102, 204, 255, 128)
+        self._text_font = QFont("Sans", 16)
+        self._stroke_pen = QPen(QColor(102, 204, 255, 200), 2)
+        self._highlight_pen = QPen(QColor(255, 255, 0, 10), 32, Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap)
+        self._erase_pen = QPen(Qt.GlobalColor.transparent, 32, Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap)
+        self._blur_preview_pen = QPen(QColor(0, 0, 0, 128), 2, Qt.PenStyle.DashLine)
+        # Rotating border: the stops never change, only the endpoints do, so
+        # build the gradient and pen once and mutate per frame. The angle is
+        # quantized to a 64-entry cos/sin table - invisible at 2px width
+        self._border_grad = QLinearGradient()
+        self._border_grad.setColorAt(0.0, QColor(255, 0, 0))  # Red starts
+        self._border_grad.setColorAt(0.3, QColor(255, 0, 0))  # Red ends at 30%
+        self._border_grad.setColorAt(0.3, QColor(128, 128, 128))  # Grey starts at 30%
+        self._border_grad.setColorAt(1.0, QColor(0, 0, 255))  # Blue ends at 100%
+        self._border_pen = QPen(QBrush(self._border_grad), 2)  # 2 pixels thick
+        angles = np.linspace(0.0, 2 * math.pi, 64, endpoint=False)
+        self._border_cos = np.cos(angles)
+        self._border_sin = np.sin(angles)
         self.ann_drawing = False
         self.ann_start_point = QPoint()
         self.ann_end_point = QPoint()
-        self.ann_temp_path = []
+        # In-progress path kept directly as a QPolygon: appends are
+        # incremental and every draw/commit site uses it without conversion
+        self.ann_temp_path = QPolygon()
         self.ann_actions = []
-        self.text_items = []
-        self.selected_text = None
+        # Text labels keyed by id with a separate draw-order list, so drag
+        # updates are a dict store rather than a list scan
+        self._text_by_id = {}
+        self._text_order = []
+        self._text_rects = {}  # id -> cached hit-test QRect, synced on add/move
+        self._next_text_id = 0
+        self._selected_text_id = None
         self.drag_offset = QPoint()
+        # Encoded chat image, invalidated whenever the annotations change
+        self._cached_b64 = None
 
-        # Chat interface elements
-        self.chat_display = QTextBrowser(self)
-        self.chat_display.setReadOnly(True)
-        self.chat_display.setStyleSheet("""
-            background-color: #212121;
-            border-radius: 10px;         
-            border: 1px solid #555;
-            color: white;
-            font-size: 14px;
-            padding: 5px;
-        """)
-        # Initial position, will be adjusted after selection
-        self.chat_display.hide()
-
-        self.message_input = QLineEdit(self)
-        self.message_input.setPlaceholderText("Type your message...")
-        self.message_input.returnPressed.connect(self.send_message)
-        self.message_input.setStyleSheet("""
-            background-color: #303030;
-            color: white;
-            border-radius: 5px;
-            padding: 5px;
-        """)
-        self.message_input.hide()
-
-        self.send_button = QPushButton("Send", self)
-        self.send_button.clicked.connect(self.send_message)
-        self.send_button.setStyleSheet("""
-            background-color: #4CAF50;
-            color: white;
-            border-radius: 5px;
-            padding: 5px 10px;
-        """)
-        self.send_button.hide()
+        # Chat interface elements are built lazily in confirm_selection:
+        # three widget constructions plus style-sheet parses have no business
+        # in the startup path while they are hidden anyway
+        self.chat_display = None
+        self.message_input = None
+        self.send_button = None
 
         self.chat_history = [] # Initialize chat history
+        # Streamed chunks are buffered and flushed at ~30 Hz; rendering and
+        # relayouting the chat per token dominated streaming cost
+        self._pending_chunks = []
+        self._chunk_timer = QTimer(self)
+        self._chunk_timer.setInterval(33)
+        self._chunk_timer.timeout.connect(self._flush_chat_chunks)
         self.llm_chunk_received.connect(self.append_chat_chunk)
         self.llm_stream_finished.connect(self.finalize_llm_response)
         self.showFullScreen()
 
+    def _on_screen_captured(self, img):
+        # restart_selection keeps the existing pixmap; this runs again only
+        # when the background truly needs refreshing.
+        self.bg_pixmap = QPixmap.fromImage(img)
+        QPixmapCache.clear()  # crops of the previous background are stale now
+
+        # Pre-composite screenshot + tint gradient + dark overlay once.
+        # paintEvent used to rebuild this stack (two full-screen alpha
+        # fills) on every repaint; now it is a single opaque blit. The result
+        # is registered in QPixmapCache keyed by screen size; the clear()
+        # above drops it whenever the underlying screenshot changes.
+        key = f"dim_{self.bg_pixmap.width()}x{self.bg_pixmap.height()}"
+        dim_bg = QPixmap()
+        if not QPixmapCache.find(key, dim_bg):
+            dim_bg = QPixmap(self.bg_pixmap.size())
+            dim_painter = QPainter(dim_bg)
+            dim_painter.drawPixmap(0, 0, self.bg_pixmap)
+            tint = QLinearGradient(0, 0, dim_bg.width(), dim_bg.height())
+            tint.setColorAt(0.0, QColor(255, 0, 0, 100))  # Red with 100 alpha
+            tint.setColorAt(1.0, QColor(0, 0, 255, 100))  # Blue with 100 alpha
+            dim_painter.fillRect(dim_bg.rect(), tint)
+            dim_painter.fillRect(dim_bg.rect(), QColor(0, 0, 0, 128))  # 50% opaque black
+            dim_painter.end()
+            QPixmapCache.insert(key, dim_bg)
+        self._dim_bg = dim_bg
+
+        self.resize(self.bg_pixmap.size())
+        self.update()
+
     def update_initial_animation(self):
         """
-        Updates the phase for the full-screen wave animation
-        and triggers a repaint.
+        Advances the rotating border gradient and triggers a repaint.
         """
-        self.gradient_phase = (self.gradient_phase + 0.05) % (2 * math.pi) # Increment phase, wrap around 2*PI
         self.border_angle = (self.border_angle + 0.03) % (2 * math.pi) # Increment border angle for rotation
-        self.update() # Request a repaint
+        if self.selection_confirmed:
+            # Only the rotating border changes; keep the damage to its bbox
+            self.update(self.selection_rect.adjusted(-20, -20, 20, 20))
+        else:
+            self.update() # Request a repaint
+
+    def _request_paint(self, rect):
+        self._pending_rect = rect if self._pending_rect.isNull() else self._pending_rect.united(rect)
+        if not self._paint_pending:
+            self._paint_pending = True
+            self._paint_timer.start()
+
+    def _flush_paint(self):
+        self._paint_pending = False
+        dirty = self._pending_rect
+        self._pending_rect = QRect()
+        if not dirty.isNull():
+            self.update(dirty)
 
     # --- Selection Phase ---
     def mousePressEvent(self, event: QMouseEvent):
         if not self.selection_confirmed:
             if event.button() == Qt.MouseButton.LeftButton:
                 self.drawing = True
-                self.strokes = []
+                self._n_strokes = 0
+                self._stroke_poly.clear()
                 self.last_point = event.position().toPoint()
-                self.strokes.append(self.last_point)
+                self._append_stroke_point(self.last_point)
         else:
             self.annotation_mousePressEvent(event)
 
@@ -141,9 +326,11 @@ class ScreenshotAnnotator(QWidget):
         if not self.selection_confirmed:
             if self.drawing:
                 pt = event.position().toPoint()
-                self.strokes.append(pt)
+                # Repaint only the bbox of the new segment, not the full screen
+                dirty = QRect(self.last_point, pt).normalized().adjusted(-4, -4, 4, 4)
+                self._append_stroke_point(pt)
                 self.last_point = pt
-                self.update()
+                self._request_paint(dirty)
         else:
             self.annotation_mouseMoveEvent(event)
 
@@ -151,31 +338,113 @@ class ScreenshotAnnotator(QWidget):
         if not self.selection_confirmed:
             if event.button() == Qt.MouseButton.LeftButton and self.drawing:
                 self.drawing = False
+                if self._n_strokes > 2:
+                    # Drop colinear samples before the bbox pass; the visual
+                    # path is unchanged at eps=1.5px
+                    pts = self._stroke_buf[:self._n_strokes]
+                    simplified = pts[rdp_np(pts, 1.5)]
+                    self._n_strokes = len(simplified)
+                    self._stroke_buf[:self._n_strokes] = simplified
                 self.computeBoundingRect()
                 self.update()
                 self.confirm_selection()
         else:
             self.annotation_mouseReleaseEvent(event)
 
+    def _append_stroke_point(self, pt):
+        x = pt.x()
+        y = pt.y()
+        # Track the bounds as points arrive so mouse-up needs no array pass
+        if self._n_strokes == 0:
+            self._min_x = self._max_x = x
+            self._min_y = self._max_y = y
+        else:
+            if x < self._min_x:
+                self._min_x = x
+            elif x > self._max_x:
+                self._max_x = x
+            if y < self._min_y:
+                self._min_y = y
+            elif y > self._max_y:
+                self._max_y = y
+        if self._n_strokes == len(self._stroke_buf):
+            self._stroke_buf = np.concatenate([self._stroke_buf, np.empty_like(self._stroke_buf)])
+        self._stroke_buf[self._n_strokes] = (x, y)
+        self._n_strokes += 1
+        self._stroke_poly.append(pt)
+
+    def _cropped_bg(self, rect):
+        # paintEvent asks for the same crop every frame while a selection is
+        # active, so cache it instead of re-copying the pixels
+        key = f"crop_{rect.x()}_{rect.y()}_{rect.width()}_{rect.height()}"
+        pm = QPixmap()
+        if not QPixmapCache.find(key, pm):
+            pm = self.bg_pixmap.copy(rect)
+            QPixmapCache.insert(key, pm)
+        return pm
+
     def computeBoundingRect(self):
-        if not self.strokes:
+        if self._n_strokes == 0:
             return
-        min_x = min(p.x() for p in self.strokes)
-        min_y = min(p.y() for p in self.strokes)
-        max_x = max(p.x() for p in self.strokes)
-        max_y = max(p.y() for p in self.strokes)
-        self.selection_rect = QRect(QPoint(min_x, min_y), QPoint(max_x, max_y)).normalized()
+        self.selection_rect = QRect(QPoint(self._min_x, self._min_y), QPoint(self._max_x, self._max_y)).normalized()
+
+    def _create_chat_widgets(self):
+        self.chat_display = QTextBrowser(self)
+        self.chat_display.setReadOnly(True)
+        self.chat_display.setStyleSheet("""
+            background-color: #212121;
+            border-radius: 10px;         
+            border: 1px solid #555;
+            color: white;
+            font-size: 14px;
+            padding: 5px;
+        """)
+
+        self.message_input = QLineEdit(self)
+        self.message_input.setPlaceholderText("Type your message...")
+        self.message_input.returnPressed.connect(self.send_message)
+        self.message_input.setStyleSheet("""
+            background-color: #303030;
+            color: white;
+            border-radius: 5px;
+            padding: 5px;
+        """)
+
+        self.send_button = QPushButton("Send", self)
+        self.send_button.clicked.connect(self.send_message)
+        self.send_button.setStyleSheet("""
+            background-color: #4CAF50;
+            color: white;
+            border-radius: 5px;
+            padding: 5px 10px;
+        """)
+
+        # One cursor held at end-of-document: inserting through it avoids the
+        # whole-block re-parse that QTextBrowser.append performs per call
+        self._chat_cursor = self.chat_display.textCursor()
+        self._stream_start_pos = None  # document position where the streamed reply begins
+        self._stream_cursor = None  # rides at the end of the streamed region
+        self._chat_cursor.movePosition(QTextCursor.MoveOperation.End)
 
     def confirm_selection(self):
         if not self.selection_rect.isValid():
             return
+        if self.chat_display is None:
+            self._create_chat_widgets()
         self.selection_confirmed = True
         self.setCursor(Qt.CursorShape.ArrowCursor)
-        self.annotation_base = self.bg_pixmap.copy(self.selection_rect)
-        self.annotation_canvas = QPixmap(self.annotation_base.size())
+        # Paint into QImages: Qt's raster engine renders straight into the
+        # premultiplied buffer without platform-backend round trips
+        self.annotation_base = self._cropped_bg(self.selection_rect).toImage().convertToFormat(
+            QImage.Format.Format_ARGB32_Premultiplied)
+        self.annotation_canvas = QImage(self.annotation_base.size(), QImage.Format.Format_ARGB32_Premultiplied)
         self.annotation_canvas.fill(Qt.GlobalColor.transparent)
         self.ann_actions = []
-        self.text_items = []
+        self._text_by_id = {}
+        self._text_order = []
+        self._text_rects = {}  # id -> cached hit-test QRect, synced on add/move
+        self._selected_text_id = None
+        self._cached_b64 = None
         self.mode_index = 0
         self.mode = MODES[self.mode_index]
         self.create_annotation_buttons()
@@ -285,148 +554,239 @@ class ScreenshotAnnotator(QWidget):
             self.ann_end_point = pt
 
             if self.mode == 'freestyle':
-                self.ann_temp_path = [self.ann_start_point]
+                self.ann_temp_path = QPolygon([self.ann_start_point])
             elif self.mode == 'highlight':
-                self.ann_temp_path = [self.ann_start_point]
+                self.ann_temp_path = QPolygon([self.ann_start_point])
             elif self.mode == 'blur':
-                self.ann_temp_path = [self.ann_start_point]
+                self.ann_temp_path = QPolygon([self.ann_start_point])
             elif self.mode == 'erase':
-                self.ann_temp_path = [self.ann_start_point]
+                self.ann_temp_path = QPolygon([self.ann_start_point])
             elif self.mode == 'text':
-                for pos, txt in reversed(self.text_items):
-                    rect = QRect(pos, QSize(200, 30))
-                    if rect.contains(self.ann_start_point):
-                        self.selected_text = (pos, txt)
-                        self.drag_offset = self.ann_start_point - pos
+                for text_id in reversed(self._text_order):
+                    if self._text_rects[text_id].contains(self.ann_start_point):
+                        self._selected_text_id = text_id
+                        self.drag_offset = self.ann_start_point - self._text_by_id[text_id][0]
                         return
                 self.ann_drawing = False
                 text, ok = QInputDialog.getText(self, "Enter Text", "Text:")
                 if ok and text:
-                    self.text_items.append((self.ann_start_point, text))
-                    self.ann_actions.append(self.annotation_canvas.copy())
+                    text_id = self._next_text_id
+                    self._next_text_id += 1
+                    # QStaticText caches the shaped glyph layout, so repeat
+                    # paints skip text shaping entirely
+                    static_text = QStaticText(text)
+                    static_text.prepare(QTransform(), self._text_font)
+                    self._text_by_id[text_id] = (self.ann_start_point, text, static_text)
+                    self._text_order.append(text_id)
+                    self._text_rects[text_id] = QRect(self.ann_start_point, QSize(200, 30))
+                    self.ann_actions.append(('text', text_id))
+                    self._cached_b64 = None
                     self.update()
 
     def annotation_mouseMoveEvent(self, event):
         pt = event.position().toPoint() - self.selection_rect.topLeft()
-        if self.selected_text:
+        if self._selected_text_id is not None:
             new_pos = pt - self.drag_offset
-            idx = self.text_items.index(self.selected_text)
-            self.text_items[idx] = (new_pos, self.selected_text[1])
-            self.update()
+            old_pos, txt, static_text = self._text_by_id[self._selected_text_id]
+            self._text_by_id[self._selected_text_id] = (new_pos, txt, static_text)
+            self._text_rects[self._selected_text_id].moveTopLeft(new_pos)
+            # Damage only the label's old and new footprint, not the widget
+            size = static_text.size().toSize()
+            dirty = QRect(old_pos, size).united(QRect(new_pos, size))
+            dirty = dirty.translated(self.selection_rect.topLeft()).adjusted(-2, -2, 2, 2)
+            self._request_paint(dirty)
             return
 
         if self.ann_drawing and self.mode != 'text':
+            prev = self.ann_end_point
             self.ann_end_point = pt
+            # Damaged region in widget coords: just the new segment for path
+            # modes, the old+new preview shape for rect/arrow/blur
+            if self.mode in ['freestyle', 'highlight', 'erase']:
+                dirty = QRect(prev, pt).normalized()
+            else:
+                dirty = QRect(self.ann_start_point, prev).united(QRect(self.ann_start_point, pt)).normalized()
+            pad = 20 if self.mode in ['highlight', 'erase'] else 6
+            dirty = dirty.translated(self.selection_rect.topLeft()).adjusted(-pad, -pad, pad, pad)
             if self.mode in ['freestyle', 'highlight', 'erase']:
                 self.ann_temp_path.append(self.ann_end_point)
-            self.update()
+            self._request_paint(dirty)
 
             # Live preview for highlight and erase
             if self.mode in ['highlight', 'erase']:
                 self.redraw_canvas()
                 painter = QPainter(self.annotation_canvas)
                 if self.mode == 'highlight':
-                    highlight_pen = QPen(QColor(255, 255, 0, 10), 32, Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap)
-                    painter.setPen(highlight_pen)
-                    for i in range(1, len(self.ann_temp_path)):
-                        painter.drawLine(self.ann_temp_path[i - 1], self.ann_temp_path[i])
+                    painter.setPen(self._highlight_pen)
+                    painter.drawPolyline(self.ann_temp_path)
                 elif self.mode == 'erase':
-                    erase_pen = QPen(Qt.GlobalColor.transparent, 32, Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap)
                     painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                    painter.setPen(erase_pen)
-                    for i in range(1, len(self.ann_temp_path)):
-                        painter.drawLine(self.ann_temp_path[i - 1], self.ann_temp_path[i])
+                    painter.setPen(self._erase_pen)
+                    painter.drawPolyline(self.ann_temp_path)
                     painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
                 painter.end()
-                self.update()
+                self._request_paint(dirty)
             elif self.mode == 'blur':
                 # Draw a preview rectangle for blur
                 self.redraw_canvas()
                 painter = QPainter(self.annotation_canvas)
                 rect = QRect(self.ann_start_point, self.ann_end_point).normalized()
-                preview_pen = QPen(QColor(0, 0, 0, 128), 2, Qt.PenStyle.DashLine)
-                painter.setPen(preview_pen)
+                painter.setPen(self._blur_preview_pen)
                 painter.drawRect(rect)
                 painter.end()
-                self.update()
+                self._request_paint(dirty)
 
     def annotation_mouseReleaseEvent(self, event):
-        if self.selected_text:
-            self.selected_text = None
+        if self._selected_text_id is not None:
+            self._selected_text_id = None
+            self._cached_b64 = None
             return
 
         if event.button() == Qt.MouseButton.LeftButton and self.ann_drawing:
             self.ann_drawing = False
-            painter = QPainter(self.annotation_canvas)
-            painter.setPen(self.pen)
 
+            action = None
             if self.mode == 'rect':
-                rect = QRect(self.ann_start_point, self.ann_end_point).normalized()
-                painter.drawRect(rect)
+                action = ('rect', self.ann_start_point, self.ann_end_point)
             elif self.mode == 'arrow':
-                self.draw_arrow(painter, self.ann_start_point, self.ann_end_point)
+                action = ('arrow', self.ann_start_point, self.ann_end_point)
             elif self.mode == 'freestyle':
-                for i in range(1, len(self.ann_temp_path)):
-                    painter.drawLine(self.ann_temp_path[i - 1], self.ann_temp_path[i])
+                action = ('freestyle', self._simplified_path())
             elif self.mode == 'blur':
-                # Apply blur to the selected rectangle
                 rect = QRect(self.ann_start_point, self.ann_end_point).normalized()
                 if rect.width() > 0 and rect.height() > 0:
-                    base_qimg = self.annotation_base.copy(rect).toImage()
+                    base_qimg = self.annotation_base.copy(rect).convertToFormat(QImage.Format.Format_RGBA8888)
                     ptr = base_qimg.bits()
                     ptr.setsize(base_qimg.sizeInBytes())
                     pil_img = Image.frombytes("RGBA", (base_qimg.width(), base_qimg.height()), bytes(ptr))
                     blurred = pil_img.filter(ImageFilter.GaussianBlur(radius=6))
                     buf = blurred.tobytes("raw", "RGBA")
-                    qimg_blur = QImage(buf, blurred.width, blurred.height, QImage.Format.Format_RGBA8888)
-                    painter.drawImage(rect.topLeft(), qimg_blur)
-            # No special action for highlight or erase on mouse release (already handled in live preview)
-            painter.end()
-            self.ann_actions.append(self.annotation_canvas.copy())
+                    # .copy() detaches from buf so the image can live in the action list
+                    qimg_blur = QImage(buf, blurred.width, blurred.height, QImage.Format.Format_RGBA8888).copy()
+                    action = ('blur', rect, qimg_blur)
+            elif self.mode in ('highlight', 'erase'):
+                # Already painted during live preview; just record the path
+                self.ann_actions.append((self.mode, self._simplified_path()))
+                self._cached_b64 = None
+                self.update()
+                return
+
+            if action is not None:
+                painter = QPainter(self.annotation_canvas)
+                painter.setPen(self.pen)
+                self._draw_command(painter, action)
+                painter.end()
+                self.ann_actions.append(action)
+                self._cached_b64 = None
             self.update()
 
+    def _simplified_path(self):
+        # Long strokes carry hundreds of mouse samples; thin them out before
+        # they enter the replay log, same eps as the selection stroke
+        n = self.ann_temp_path.size()
+        if n <= 2:
+            return QPolygon(self.ann_temp_path)
+        pts = np.empty((n, 2), dtype=np.int32)
+        for i in range(n):
+            p = self.ann_temp_path.point(i)
+            pts[i, 0] = p.x()
+            pts[i, 1] = p.y()
+        keep = rdp_np(pts, 1.5)
+        out = QPolygon()
+        for i in range(n):
+            if keep[i]:
+                out.append(self.ann_temp_path.point(i))
+        return out
+
     def draw_arrow(self, painter: QPainter, p1: QPoint, p2: QPoint):
         painter.drawLine(p1, p2)
-        angle = math.atan2(p2.y() - p1.y(), p2.x() - p1.x())
-        length = 10
-        angle1 = angle + math.pi / 6
-        angle2 = angle - math.pi / 6
+        # Rotate the back-pointing unit vector by the precomputed +/- 30
+        # degrees; one hypot replaces atan2 plus two cos/sin pairs
+        dx = p1.x() - p2.x()
+        dy = p1.y() - p2.y()
+        n = math.hypot(dx, dy) or 1
+        ux = dx / n * _ARROW_LEN
+        uy = dy / n * _ARROW_LEN
         arrow_p1 = QPoint(
-            int(p2.x() - length * math.cos(angle1)),
-            int(p2.y() - length * math.sin(angle1))
+            int(p2.x() + ux * _ARROW_CA - uy * _ARROW_SA),
+            int(p2.y() + uy * _ARROW_CA + ux * _ARROW_SA)
         )
         arrow_p2 = QPoint(
-            int(p2.x() - length * math.cos(angle2)),
-            int(p2.y() - length * math.sin(angle2))
+            int(p2.x() + ux * _ARROW_CA + uy * _ARROW_SA),
+            int(p2.y() + uy * _ARROW_CA - ux * _ARROW_SA)
         )
         painter.drawLine(p2, arrow_p1)
         painter.drawLine(p2, arrow_p2)
 
     def undo(self):
         if self.ann_actions:
-            self.ann_actions.pop()
+            action = self.ann_actions.pop()
+            if action[0] == 'text':
+                self._text_by_id.pop(action[1], None)
+                self._text_rects.pop(action[1], None)
+                if action[1] in self._text_order:
+                    self._text_order.remove(action[1])
+            self._cached_b64 = None
             self.redraw_canvas()
             self.update()
 
+    def _draw_command(self, painter, action):
+        # Single dispatch point for annotation commands, shared by the
+        # mouse-release path and the undo replay
+        tag = action[0]
+        if tag == 'rect':
+            # Axis-aligned, so AA buys nothing but costs ~2x the fill
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, False)
+            painter.drawRect(QRect(action[1], action[2]).normalized())
+        elif tag == 'arrow':
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+            self.draw_arrow(painter, action[1], action[2])
+        elif tag == 'freestyle':
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+            painter.drawPolyline(action[1])
+        elif tag == 'blur':
+            painter.drawImage(action[1].topLeft(), action[2])
+        elif tag == 'highlight':
+            painter.setPen(self._highlight_pen)
+            painter.drawPolyline(action[1])
+            painter.setPen(self.pen)
+        elif tag == 'erase':
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
+            painter.setPen(self._erase_pen)
+            painter.drawPolyline(action[1])
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+            painter.setPen(self.pen)
+        # 'text' actions live in _text_by_id and are drawn at paint time
+
     def redraw_canvas(self):
+        # Replay the recorded actions; each entry is a lightweight command
+        # tuple rather than a full canvas snapshot
         self.annotation_canvas.fill(Qt.GlobalColor.transparent)
-        for pix in self.ann_actions:
-            p = QPainter(self.annotation_canvas)
-            p.drawPixmap(0, 0, pix)
-            p.end()
+        painter = QPainter(self.annotation_canvas)
+        painter.setPen(self.pen)
+        for action in self.ann_actions:
+            self._draw_command(painter, action)
+        painter.end()
 
     def save_final_image(self):
-        final = QImage(self.selection_rect.size(), QImage.Format.Format_RGBA8888)
-        final.fill(Qt.GlobalColor.white)
+        if not self.ann_actions and not self._text_order:
+            # Nothing was drawn; the base crop already is the final image
+            QThreadPool.globalInstance().start(_ImageSaveTask(self.annotation_base.copy(), "selection_edited.png"))
+            self.close()
+            return
+        # The opaque base covers every pixel, so start from a copy of it
+        # rather than white-filling a fresh image only to overdraw it.
+        # RGB32 is Qt's fast opaque format and the output needs no alpha.
+        final = self.annotation_base.convertToFormat(QImage.Format.Format_RGB32)
         p = QPainter(final)
-        p.drawPixmap(0, 0, self.annotation_base)
-        p.drawPixmap(0, 0, self.annotation_canvas)
+        p.drawImage(0, 0, self.annotation_canvas)
         p.setPen(self.pen)
-        p.setFont(QFont("Sans", 16))
-        for pos, text in self.text_items:
-            p.drawText(pos, text)
+        p.setFont(self._text_font)
+        for text_id in self._text_order:
+            pos, _, static_text = self._text_by_id[text_id]
+            p.drawStaticText(pos, static_text)
         p.end()
-        final.save("selection_edited.png")
+        QThreadPool.globalInstance().start(_ImageSaveTask(final, "selection_edited.png"))
         self.close()
 
     def restart_selection(self):
@@ -436,41 +796,53 @@ class ScreenshotAnnotator(QWidget):
         self.annotation_buttons = []
         self.setCursor(Qt.CursorShape.CrossCursor)
         self.selection_rect = QRect()
-        self.chat_display.hide()
-        self.message_input.hide()
-        self.send_button.hide()
+        if self.chat_display is not None:
+            self.chat_display.hide()
+            self.message_input.hide()
+            self.send_button.hide()
         self.update()
 
     def get_current_annotated_image_base64(self):
         if not self.selection_confirmed or not self.selection_rect.isValid():
             return None
 
-        # Create a QImage to draw the current annotated state
-        combined_image = QImage(self.selection_rect.size(), QImage.Format.Format_RGBA8888)
-        combined_image.fill(Qt.GlobalColor.transparent) # Start with transparent background
+        # Re-encode only when the annotations changed since the last send
+        if self._cached_b64 is not None:
+            return self._cached_b64
+
+        # Compose into a QPixmap (the faster render target for Qt's
+        # backends) and only convert to QImage at the encode boundary
+        combined_pm = QPixmap(self.selection_rect.size())
+        combined_pm.fill(Qt.GlobalColor.white) # JPEG has no alpha; flatten on white
 
-        painter = QPainter(combined_image)
+        painter = QPainter(combined_pm)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
         # Draw the base image
-        painter.drawPixmap(0, 0, self.annotation_base)
+        painter.drawImage(0, 0, self.annotation_base)
 
         # Draw the annotation canvas
-        painter.drawPixmap(0, 0, self.annotation_canvas)
+        painter.drawImage(0, 0, self.annotation_canvas)
 
         # Draw text items
         painter.setPen(self.pen)
-        painter.setFont(QFont("Sans", 16))
-        for pos, text in self.text_items:
-            painter.drawText(pos, text)
+        painter.setFont(self._text_font)
+        for text_id in self._text_order:
+            pos, _, static_text = self._text_by_id[text_id]
+            painter.drawStaticText(pos, static_text)
         painter.end()
 
-        # Convert QImage to bytes using QBuffer and then to base64
+        combined_image = combined_pm.toImage().convertToFormat(QImage.Format.Format_RGB32)
+
+        # Convert QImage to bytes using QBuffer and then to base64. JPEG is
+        # several times faster to encode than PNG and much smaller on the
+        # wire; the chat upload doesn't need alpha.
         byte_array = QBuffer()
         byte_array.open(QIODevice.OpenModeFlag.WriteOnly)
-        combined_image.save(byte_array, "PNG") # Save as PNG to maintain transparency
+        combined_image.save(byte_array, "JPEG", 85)
         encoded_image = base64.b64encode(byte_array.data()).decode("utf-8")
         byte_array.close()
+        self._cached_b64 = encoded_image
         return encoded_image
 
     # --- Paint ---
@@ -479,57 +851,62 @@ class ScreenshotAnnotator(QWidget):
         Handles the painting of the widget, including background, selection,
         annotations, and the LLM thinking animation.
         """
-        painter = QPainter(self)
-
-        # 1. Draw the original full screenshot
-        painter.drawPixmap(0, 0, self.bg_pixmap)
-
-        # 2. Draw the animated gradient over the entire screen (always active)
-        # Using fixed RGB values for red and blue for the background gradient
-        color1_bg = QColor(255, 0, 0, 100) # Red with 100 alpha
-        color2_bg = QColor(0, 0, 255, 100) # Blue with 100 alpha
-
-        gradient_full_screen = QLinearGradient(0, 0, self.width(), self.height())
-        gradient_full_screen.setColorAt(0.0, color1_bg)
-        gradient_full_screen.setColorAt(1.0, color2_bg)
-        painter.fillRect(self.rect(), gradient_full_screen)
+        if self._dim_bg.isNull():
+            # Capture still in flight; nothing to paint yet
+            return
 
+        painter = QPainter(self)
+        # Only repaint the damaged region; mouse drags pass tiny dirty rects
+        painter.setClipRect(event.rect())
 
-        # 3. Draw the dark overlay over the entire screen (on top of the background gradient)
-        overlay_color = QColor(0, 0, 0, 128) # 50% opaque black
-        painter.fillRect(self.rect(), overlay_color)
+        # 1. Draw the pre-composited screenshot + gradient + dark overlay.
+        # With a confirmed selection, clip it to the outside of the
+        # selection so the revealed area isn't dimmed and then overdrawn
+        if self.selection_confirmed and self.selection_rect.isValid():
+            painter.save()
+            painter.setClipRegion(
+                QRegion(event.rect()).subtracted(QRegion(self.selection_rect)))
+            painter.drawPixmap(0, 0, self._dim_bg)
+            painter.restore()
+        else:
+            painter.drawPixmap(0, 0, self._dim_bg)
 
         # 4. If selection is confirmed, reveal the selected area and draw specific gradients/elements
         if self.selection_confirmed and self.selection_rect.isValid():
-            # A. Reveal the selected area by drawing the original content there (drawn LAST to cover gradients)
-            cropped = self.bg_pixmap.copy(self.selection_rect)
-            painter.drawPixmap(self.selection_rect.topLeft(), cropped)
+            # A. Reveal the selected area with a source-rect blit straight
+            # from the background; no cropped copy needed
+            painter.drawPixmap(self.selection_rect, self.bg_pixmap, self.selection_rect)
 
             # C. Draw annotations on top of the revealed screenshot
-            painter.drawPixmap(self.selection_rect.topLeft(), self.annotation_canvas)
+            painter.drawImage(self.selection_rect.topLeft(), self.annotation_canvas)
 
-            # D. Draw the current temporary annotation being drawn
+            # D./E. Draw the in-progress annotation and the text labels in
+            # selection-local coordinates under a single saved transform
+            offset = self.selection_rect.topLeft()
+            painter.save()
+            painter.translate(offset)
             painter.setPen(self.pen)
             if self.ann_drawing and self.mode != 'text':
-                painter.save()
-                painter.translate(self.selection_rect.topLeft())
                 if self.mode == 'rect':
+                    # Axis-aligned preview: skip AA, it only doubles fill cost
+                    painter.setRenderHint(QPainter.RenderHint.Antialiasing, False)
                     rect = QRect(self.ann_start_point, self.ann_end_point).normalized()
                     painter.drawRect(rect)
                 elif self.mode == 'freestyle':
-                    for i in range(1, len(self.ann_temp_path)):
-                        painter.drawLine(self.ann_temp_path[i - 1], self.ann_temp_path[i])
+                    painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+                    painter.drawPolyline(self.ann_temp_path)
                 elif self.mode == 'arrow':
+                    painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
                     self.draw_arrow(painter, self.ann_start_point, self.ann_end_point)
-                painter.restore()
-
-            # E. Draw all text annotations
-            painter.setPen(self.pen)
-            painter.setFont(QFont("Sans", 16))
-            painter.save()
-            painter.translate(self.selection_rect.topLeft())
-            for pos, text in self.text_items:
-                painter.drawText(pos, text)
+                painter.setRenderHint(QPainter.RenderHint.Antialiasing, False)
+
+            painter.setFont(self._text_font)
+            for text_id in self._text_order:
+                pos, _, static_text = self._text_by_id[text_id]
+                # Skip labels outside the damaged region
+                bounds = QRect(pos + offset, static_text.size().toSize())
+                if bounds.intersects(event.rect()):
+                    painter.drawStaticText(pos, static_text)
             painter.restore()
 
             # Add a red-grey-blue gradient border around the selected area
@@ -541,27 +918,18 @@ class ScreenshotAnnotator(QWidget):
             # It should be large enough to cover the diagonal
             gradient_line_length = math.sqrt(self.selection_rect.width()**2 + self.selection_rect.height()**2)
 
-            # Calculate start and end points for the linear gradient based on the rotating angle
-            # These points are relative to the center of the selection_rect
-            start_x_rel = -gradient_line_length / 2 * math.cos(self.border_angle)
-            start_y_rel = -gradient_line_length / 2 * math.sin(self.border_angle)
-            end_x_rel = gradient_line_length / 2 * math.cos(self.border_angle)
-            end_y_rel = gradient_line_length / 2 * math.sin(self.border_angle)
-
-            # Convert relative points to absolute screen coordinates
-            gradient_start_point = QPointF(center_x + start_x_rel, center_y + start_y_rel)
-            gradient_end_point = QPointF(center_x + end_x_rel, center_y + end_y_rel)
-            
-            border_gradient = QLinearGradient(gradient_start_point, gradient_end_point)
-            
-            # Setting color stops for 3:7 red to (grey to blue) ratio
-            border_gradient.setColorAt(0.0, QColor(255, 0, 0)) # Red starts
-            border_gradient.setColorAt(0.3, QColor(255, 0, 0)) # Red ends at 30%
-            border_gradient.setColorAt(0.3, QColor(128, 128, 128)) # Grey starts at 30%
-            border_gradient.setColorAt(1.0, QColor(0, 0, 255)) # Blue ends at 100%
-
-            gradient_pen = QPen(border_gradient, 2) # 2 pixels thick
-            painter.setPen(gradient_pen)
+            # Endpoints for the rotating gradient, relative to the center;
+            # the quantized angle indexes the precomputed cos/sin table
+            bucket = int(self.border_angle / (2 * math.pi) * 64) % 64
+            end_x_rel = gradient_line_length / 2 * self._border_cos[bucket]
+            end_y_rel = gradient_line_length / 2 * self._border_sin[bucket]
+
+            # Mutate the cached gradient's endpoints; color stops were set
+            # once in __init__ (3:7 red to grey-to-blue ratio)
+            self._border_grad.setStart(center_x - end_x_rel, center_y - end_y_rel)
+            self._border_grad.setFinalStop(center_x + end_x_rel, center_y + end_y_rel)
+            self._border_pen.setBrush(QBrush(self._border_grad))
+            painter.setPen(self._border_pen)
             painter.setBrush(Qt.BrushStyle.NoBrush) # No fill for the border
             
             # Add rounded edges to the border
@@ -569,19 +937,17 @@ class ScreenshotAnnotator(QWidget):
             painter.drawRoundedRect(QRectF(self.selection_rect), border_radius, border_radius)
 
         # 4. If selection is NOT confirmed, draw the selection stroke
-        elif self.drawing and len(self.strokes) > 1:
-            pen = QPen(QColor(102, 204, 255, 200), 2)
-            painter.setPen(pen)
-            for i in range(len(self.strokes) - 1):
-                painter.drawLine(self.strokes[i], self.strokes[i + 1])
+        elif self.drawing and self._n_strokes > 1:
+            painter.setPen(self._stroke_pen)
+            painter.drawPolyline(self._stroke_poly)
 
     def send_message(self):
         user_message = self.message_input.text().strip()
         if not user_message and not self.selection_confirmed: # Don't send empty message if no selection
             return
 
-        self.chat_display.append(f"<b>You:</b> {user_message}")
-        self.chat_display.append("\n")
+        self._chat_cursor.insertHtml(f"<b>You:</b> {html.escape(user_message)}<br><br>")
+        self.chat_display.ensureCursorVisible()
         self.message_input.clear()
 
         # Prepare message content, including image if available
@@ -595,56 +961,112 @@ class ScreenshotAnnotator(QWidget):
             if encoded_image:
                 message_content.append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{encoded_image}"}
+                    "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}
                 })
 
         if message_content:
-            if not self.chat_history or self.chat_history[-1]["role"] == "assistant":
-                self.chat_history.append({"role": "user", "content": message_content})
-            else:
-                self.chat_history[-1]["content"].extend(message_content)
-
-            # Run LLM call in a separate thread
-            thread = threading.Thread(target=self.get_llm_response)
-            thread.start()
-
-    def get_llm_response(self):
+            # Always a fresh turn; extending the previous user dict in place
+            # meant every send re-uploaded all prior images
+            self.chat_history.append({"role": "user", "content": message_content})
+
+            # Stream on the shared qasync loop; chunks arrive through the
+            # native event loop, no worker thread or processEvents polling
+            asyncio.ensure_future(self.get_llm_response())
+
+    def _outbound_history(self):
+        # Only the latest user turn carries its image; earlier base64
+        # payloads are swapped for a short note so each request uploads one
+        # image instead of every image sent so far
+        last_user = -1
+        for i, msg in enumerate(self.chat_history):
+            if msg["role"] == "user":
+                last_user = i
+        messages = []
+        for i, msg in enumerate(self.chat_history):
+            content = msg["content"]
+            if i != last_user and isinstance(content, list):
+                content = [part if part.get("type") != "image_url"
+                           else {"type": "text", "text": "[image sent above]"}
+                           for part in content]
+            messages.append({"role": msg["role"], "content": content})
+        return messages
+
+    async def get_llm_response(self):
+        # Block sends while a stream is in flight: a mid-stream send would
+        # insert through a cursor parked at the stream end (shifting
+        # _stream_cursor past it) and spawn a second stream writing into
+        # the same cursor and chunk buffer
+        self.message_input.setEnabled(False)
+        self.send_button.setEnabled(False)
         try:
             full_response_content = ""
-            # First, emit a signal to indicate that the LLM is starting to respond
-            self.llm_chunk_received.emit("<b><i>Sherlock: </i></b>")
-
-            for chunk in litellm.completion(
+            # The coroutine runs on the GUI thread under qasync, so the
+            # header can go straight in; remember where the reply starts so
+            # finalize can swap the plain stream for rendered markdown
+            self._chat_cursor.insertHtml("<b><i>Sherlock: </i></b>")
+            self._stream_cursor = QTextCursor(self._chat_cursor)
+            self._stream_start_pos = self._stream_cursor.position()
+
+            stream = await litellm.acompletion(
                 model="gemini/gemini-1.5-flash",
-                messages=self.chat_history,
+                messages=self._outbound_history(),
                 stream=True
-            ):
+            )
+            async for chunk in stream:
                 if chunk.choices[0].delta.content:
                     content_chunk = chunk.choices[0].delta.content
                     self.llm_chunk_received.emit(content_chunk)
                     full_response_content += content_chunk
-            
+
             self.llm_stream_finished.emit(full_response_content)
 
         except Exception as e:
-            self.llm_chunk_received.emit(f"<i>Error:</i> {e}")
+            self.llm_chunk_received.emit(f"Error: {e}")
+        finally:
+            self.message_input.setEnabled(True)
+            self.send_button.setEnabled(True)
+            self.message_input.setFocus()
 
     def append_chat_chunk(self, chunk):
-        html_chunk = markdown.markdown(chunk,extensions=['extra']).strip()
-        # Remove paragraph tags for smoother streaming
-        if html_chunk.startswith("<p>") and html_chunk.endswith("</p>"):
-            html_chunk = html_chunk[3:-4]
-            
-        self.chat_display.insertHtml(html_chunk + " ")
+        self._pending_chunks.append(chunk)
+        if not self._chunk_timer.isActive():
+            self._chunk_timer.start()
+
+    def _flush_chat_chunks(self):
+        if not self._pending_chunks:
+            self._chunk_timer.stop()
+            return
+        text = "".join(self._pending_chunks)
+        self._pending_chunks.clear()
+        # Plain escaped text while streaming; markdown runs once at the end,
+        # not over the growing accumulation on every flush
+        cursor = self._stream_cursor if self._stream_cursor is not None else self._chat_cursor
+        cursor.insertHtml(html.escape(text).replace("\n", "<br>"))
         self.chat_display.ensureCursorVisible()
-        QApplication.processEvents()
 
     def finalize_llm_response(self, full_response):
+        self._flush_chat_chunks()
+        self._chunk_timer.stop()
+        if self._stream_cursor is not None:
+            # Replace only the streamed region with the one authoritative
+            # markdown render; sends are disabled during streaming, so
+            # nothing else has inserted inside the region
+            self._stream_cursor.setPosition(self._stream_start_pos,
+                                            QTextCursor.MoveMode.KeepAnchor)
+            self._stream_cursor.removeSelectedText()
+            self._stream_cursor.insertHtml(markdown.markdown(full_response, extensions=['extra']))
+            self._stream_cursor.insertHtml("<br><br>") # Newline for separation
+            self._stream_cursor = None
+            self._stream_start_pos = None
         self.chat_history.append({"role": "assistant", "content": full_response})
-        self.chat_display.append("") # Add a newline for separation
+        self.chat_display.ensureCursorVisible()
 
 
 if __name__ == "__main__":
+    QApplication.setAttribute(Qt.ApplicationAttribute.AA_UseOpenGLES)
     app = QApplication(sys.argv)
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
     window = ScreenshotAnnotator()
-    sys.exit(app.exec())
+    with loop:
+        sys.exit(loop.run_forever())